@@ -19,27 +19,120 @@ Privacy & Logging Rules:
 """
 
 import os
+import asyncio
+import io
 import json
+import logging
+import queue
 import time
 import uuid
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import HTMLResponse, Response
-from fastapi.templating import Jinja2Templates
-from openai import AsyncOpenAI
+import wave
+from collections import deque
+from contextlib import AsyncExitStack, asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
+import httpx
+import orjson
+import redis.asyncio as redis
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
+from openai import AsyncOpenAI, OpenAIError
 from pydantic import BaseModel
 
-app = FastAPI(title="Therapy Chat Demo")
-templates = Jinja2Templates(directory="templates")
+try:
+    # Optional: voice activity detection for /api/stt (see below)
+    import av
+    import webrtcvad
+except ImportError:
+    av = None
+    webrtcvad = None
+
+# =============================================================================
+# LOGGING
+# =============================================================================
+# Handlers only enqueue log records; a background listener thread does the
+# actual writing, so a slow stdout consumer never blocks the event loop.
+# Metadata only - never log clinical content.
+
+logger = logging.getLogger("therapy_chat")
+logger.setLevel(logging.INFO)
+logger.propagate = False
+
+_log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(_log_queue))
+
+_stream_handler = logging.StreamHandler()
+_stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = QueueListener(_log_queue, _stream_handler)
+
 
 _openai_client = None
 
+
+def _create_openai_client():
+    """
+    Build the OpenAI client on a pooled keep-alive HTTP client.
+
+    HTTP/2 lets concurrent chat streams multiplex over a single TLS
+    connection instead of each holding its own HTTP/1.1 connection.
+    """
+    # Check the key first: if AsyncOpenAI() raised, the HTTP client would
+    # never be closed, and this runs again on every request
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise OpenAIError("The api_key client option must be set via the OPENAI_API_KEY environment variable")
+    http_client = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        timeout=httpx.Timeout(60.0, connect=5.0),
+    )
+    return AsyncOpenAI(api_key=api_key, http_client=http_client)
+
 def get_openai_client():
     """Singleton pattern for OpenAI client to reuse connections and reduce latency."""
     global _openai_client
     if _openai_client is None:
-        _openai_client = AsyncOpenAI()
+        _openai_client = _create_openai_client()
     return _openai_client
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts the log listener, connects the billing store and creates the
+    OpenAI client at startup, priming its connection pool.
+
+    A cheap models.list() call (no retries, 5s timeout, same connection
+    pool) pays DNS + TLS handshake costs at boot instead of on the first
+    user's request. Failures are ignored so the app still starts without
+    network access or an API key; in that case the client is created
+    lazily on the first request, as before.
+    """
+    global _openai_client
+    _log_listener.start()
+    open_billing_store()
+    try:
+        # Fail fast: uvicorn does not accept connections until startup ends
+        await get_openai_client().with_options(max_retries=0, timeout=5.0).models.list()
+    except Exception:
+        # e.g. missing API key - requests will surface the error to the user
+        logger.warning("OpenAI connection warm-up failed; continuing without it")
+    yield
+    # Let in-flight billing writes finish before their store is closed
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    if _openai_client is not None:
+        await _openai_client.close()
+        # A closed client must not be reused if the app is started again
+        _openai_client = None
+    await close_billing_store()
+    _log_listener.stop()
+
+
+app = FastAPI(title="Therapy Chat Demo", lifespan=lifespan)
+
+# The frontend page is static, so it is read once and served as raw bytes
+_INDEX_HTML = (Path(__file__).parent / "templates" / "index.html").read_bytes()
+
 # =============================================================================
 # MASTER PROMPT INJECTION
 # =============================================================================
@@ -53,14 +146,170 @@ You respond with warmth, clarity, and psychological insight.
 [TODO: real master prompt text will be pasted here later.]
 """
 
+# The master prompt never changes at runtime, so its message dict is built once
+# and shared by every request. The OpenAI client serializes it without mutation.
+_SYSTEM_MSG = {"role": "system", "content": MASTER_THERAPY_PROMPT}
+
 # =============================================================================
 # BILLING RECORDS (In-Memory for Demo)
 # =============================================================================
 # Stores only metadata: session_id, duration_seconds, model
 # Does NOT store any clinical content, patient text, or responses
 # In production, this would be stored in a secure database
+#
+# Records are stored as compact tuples (session_id, duration_ns, model,
+# end_time_epoch) in a bounded deque; formatting into dicts happens only when
+# /billing-debug is read, keeping the chat hot path allocation-light.
+# Durations come from the monotonic clock as integer nanoseconds, so NTP
+# adjustments cannot skew them; end_time_epoch is wall-clock for display.
+#
+# When several server worker processes run, an in-process deque only sees its
+# own worker's sessions. Setting REDIS_URL switches to a shared Redis list
+# (same tuples, orjson-encoded, capped at the same length) so /billing-debug
+# aggregates across all workers.
+
+BILLING_RECORDS_MAX = 10000
+BILLING_RECORDS = deque(maxlen=BILLING_RECORDS_MAX)
+
+REDIS_URL = os.environ.get("REDIS_URL")
+_BILLING_REDIS_KEY = "billing_records"
+_redis_client = None
+
+
+def open_billing_store():
+    """Connect to Redis for shared billing records if REDIS_URL is set."""
+    global _redis_client
+    if REDIS_URL:
+        _redis_client = redis.from_url(REDIS_URL)
+
+
+async def close_billing_store():
+    """Close the Redis connection, if one was opened."""
+    if _redis_client is not None:
+        await _redis_client.aclose()
+
+
+async def record_billing(record: tuple):
+    """Store a (session_id, duration_ns, model, end_time) billing record."""
+    if _redis_client is None:
+        BILLING_RECORDS.append(record)
+        return
+    async with _redis_client.pipeline(transaction=False) as pipe:
+        pipe.rpush(_BILLING_REDIS_KEY, orjson.dumps(record))
+        pipe.ltrim(_BILLING_REDIS_KEY, -BILLING_RECORDS_MAX, -1)
+        await pipe.execute()
+
+
+# Strong references to fire-and-forget tasks, so they are not garbage
+# collected before they finish
+_background_tasks = set()
+
+
+def run_in_background(coro):
+    """Schedule a coroutine off the request's critical path."""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def record_turn(session_id: str, duration_ns: int, model: str, end_time: float,
+                      event: str = "done"):
+    """Record billing metadata for a finished (or cancelled) chat turn and log it."""
+    try:
+        await record_billing((session_id, duration_ns, model, end_time))
+    except Exception:
+        logger.warning("session=%s event=%s", session_id, "billing_error")
+        return
+    # Metadata logging only
+    logger.info("session=%s event=%s dur=%.2f", session_id, event, duration_ns / 1e9)
 
-BILLING_RECORDS = []
+
+async def load_billing_records() -> list[tuple]:
+    """Return all stored billing records, oldest first."""
+    if _redis_client is None:
+        return list(BILLING_RECORDS)
+    raw_records = await _redis_client.lrange(_BILLING_REDIS_KEY, 0, -1)
+    return [tuple(orjson.loads(raw)) for raw in raw_records]
+
+# =============================================================================
+# WEBSOCKET FRAMES
+# =============================================================================
+# Frames are sent as pre-serialized JSON bytes. Only the variable text of a
+# chunk is encoded per token; the fixed parts are serialized exactly once.
+# Chunk frames are built inline in stream_reply(), the per-token hot path.
+# Each frame ends with a newline so several frames can share one WebSocket
+# message (newline-delimited JSON); orjson always escapes newlines in strings.
+
+_CHUNK_PREFIX = b'{"type":"chunk","text":'
+_ERROR_PREFIX = b'{"type":"error","text":'
+_FRAME_SUFFIX = b'}\n'
+_DONE_FRAME = b'{"type":"done"}\n'
+
+# Coalescing thresholds: flush as soon as this many bytes are buffered;
+# otherwise a timer flushes whatever is buffered at this interval.
+FLUSH_MAX_BYTES = 512
+FLUSH_INTERVAL_SECONDS = 0.015
+
+
+def encode_error_frame(text: str) -> bytes:
+    """Encode an error message as a JSON frame."""
+    return _ERROR_PREFIX + orjson.dumps(text) + _FRAME_SUFFIX
+
+
+class FrameBatcher:
+    """
+    Coalesces small frames into fewer WebSocket messages.
+
+    Token deltas from OpenAI are tiny, so sending each one individually costs a
+    syscall, a frame header and a client-side parse per token. Frames are
+    buffered and flushed when FLUSH_MAX_BYTES is reached, on every tick of a
+    FLUSH_INTERVAL_SECONDS background timer, or when flush() is called
+    explicitly. The timer bounds the latency of a partially filled buffer.
+    """
+
+    def __init__(self, websocket: WebSocket):
+        self._websocket = websocket
+        self._buf = bytearray()
+        self._lock = asyncio.Lock()
+        self._timer = None
+
+    async def __aenter__(self):
+        self._timer = asyncio.create_task(self._flush_periodically())
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._timer.cancel()
+        try:
+            await self._timer
+        except asyncio.CancelledError:
+            pass
+
+    async def add(self, frame: bytes):
+        """Buffer a frame, flushing once FLUSH_MAX_BYTES is reached."""
+        self._buf += frame
+        if len(self._buf) >= FLUSH_MAX_BYTES:
+            await self.flush()
+
+    async def flush(self):
+        """Send all buffered frames as a single WebSocket message."""
+        async with self._lock:
+            if not self._buf:
+                return
+            data = bytes(self._buf)
+            self._buf.clear()
+            await self._websocket.send_bytes(data)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL_SECONDS)
+            try:
+                await self.flush()
+            except Exception:
+                # The connection is gone; the caller's next send reports it.
+                # Raising here would surface from __aexit__ and mask the
+                # caller's own exception (e.g. CancelledError on disconnect).
+                return
 
 # =============================================================================
 # MESSAGE BUILDING WITH WHISPER SUPPORT
@@ -79,14 +328,14 @@ def build_messages(patient_text: str, therapist_whisper: str | None = None):
     
     - Patient text: The user's message (never logged or stored).
     """
-    messages = [
-        {"role": "system", "content": MASTER_THERAPY_PROMPT},
-    ]
     if therapist_whisper:
         # Whisper = optional second system message for session-specific instructions
-        messages.append({"role": "system", "content": therapist_whisper})
-    messages.append({"role": "user", "content": patient_text})
-    return messages
+        return [
+            _SYSTEM_MSG,
+            {"role": "system", "content": therapist_whisper},
+            {"role": "user", "content": patient_text},
+        ]
+    return [_SYSTEM_MSG, {"role": "user", "content": patient_text}]
 
 
 # =============================================================================
@@ -100,9 +349,9 @@ async def health_check():
 
 
 @app.get("/", response_class=HTMLResponse)
-async def get_index(request: Request):
+async def get_index():
     """Serves the one-page frontend chat interface."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    return HTMLResponse(content=_INDEX_HTML)
 
 
 @app.get("/billing-debug")
@@ -118,10 +367,19 @@ async def billing_debug():
     
     Returns only metadata (session_id, duration, model) - no clinical content.
     """
+    records = [
+        {
+            "session_id": session_id,
+            "duration_seconds": round(duration_ns / 1e9, 2),
+            "model": model,
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(end_time)),
+        }
+        for session_id, duration_ns, model, end_time in await load_billing_records()
+    ]
     return {
         "note": "Debug endpoint - would be secured in production",
-        "total_sessions": len(BILLING_RECORDS),
-        "records": BILLING_RECORDS
+        "total_sessions": len(records),
+        "records": records
     }
 
 
@@ -129,9 +387,225 @@ class TTSRequest(BaseModel):
     text: str
 
 
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that always closes an upstream resource.
+    
+    The exit stack is closed once the response finishes, fails or is
+    abandoned, including when sending the headers fails because the client
+    already left and the body generator never starts.
+    """
+    
+    def __init__(self, content, exit_stack: AsyncExitStack, **kwargs):
+        super().__init__(content, **kwargs)
+        self.exit_stack = exit_stack
+    
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.exit_stack.aclose()
+
+
+# =============================================================================
+# TEXT-TO-SPEECH SETTINGS
+# =============================================================================
+# gpt-4o-mini-tts with raw PCM output gives the lowest time to first audio:
+# PCM has no codec framing, so every streamed byte is immediately playable.
+# The frontend schedules the samples through the Web Audio API.
+# Voice options: alloy, ash, ballad, coral, echo, fable, nova, onyx, sage, shimmer
+
+TTS_MODEL = "gpt-4o-mini-tts"
+TTS_VOICE = "nova"  # Nova has a warm, conversational tone suitable for therapy
+TTS_RESPONSE_FORMAT = "pcm"
+TTS_MEDIA_TYPE = "audio/pcm; rate=24000"
+
+
 from fastapi import UploadFile, File
 
 
+# =============================================================================
+# VOICE ACTIVITY DETECTION (Speech-to-Text preprocessing)
+# =============================================================================
+# Recordings often contain long stretches of silence. Before transcription the
+# upload is decoded to 16kHz mono PCM, non-speech is trimmed with WebRTC VAD,
+# and the remaining speech is split into chunks Whisper handles comfortably;
+# long recordings are transcribed as several concurrent requests.
+# Fewer audio seconds means lower latency and cost, and avoids Whisper
+# hallucinating text in silent sections. Padding around each speech segment
+# keeps word boundaries intact.
+#
+# Requires the optional `av` and `webrtcvad` packages; without them (or if the
+# upload cannot be decoded) the original audio is sent to Whisper unchanged.
+
+VAD_SAMPLE_RATE = 16000
+VAD_FRAME_MS = 30
+VAD_AGGRESSIVENESS = 2  # 0 (least) to 3 (most aggressive at filtering non-speech)
+# Pauses shorter than VAD_MIN_SILENCE_MS are kept intact; longer ones are
+# dropped except for VAD_PADDING_MS of context on either side. Must be at
+# least 2 * VAD_PADDING_MS so padded segments never overlap.
+VAD_MIN_SILENCE_MS = 700
+VAD_PADDING_MS = 200
+STT_CHUNK_SECONDS = 25
+STT_MAX_CONCURRENCY = 5
+
+_PCM_BYTES_PER_MS = VAD_SAMPLE_RATE * 2 // 1000  # 16-bit mono
+
+
+def _decode_to_pcm(audio_file) -> bytes:
+    """
+    Decode an uploaded recording to 16kHz mono 16-bit PCM.
+    
+    mode="r" is required: upload temp files are opened "w+b", which PyAV
+    would otherwise treat as an output container.
+    """
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=VAD_SAMPLE_RATE)
+    pcm = bytearray()
+    with av.open(audio_file, mode="r") as container:
+        for frame in container.decode(audio=0):
+            for out in resampler.resample(frame):
+                pcm += bytes(out.planes[0])[:out.samples * 2]
+        for out in resampler.resample(None):
+            pcm += bytes(out.planes[0])[:out.samples * 2]
+    return bytes(pcm)
+
+
+_VAD_FRAME_BYTES = VAD_FRAME_MS * _PCM_BYTES_PER_MS
+
+
+def _speech_flags(pcm: bytes) -> list[bool]:
+    """Run VAD over a PCM buffer; one speech/non-speech flag per frame."""
+    vad = webrtcvad.Vad(VAD_AGGRESSIVENESS)
+    return [
+        vad.is_speech(pcm[start:start + _VAD_FRAME_BYTES], VAD_SAMPLE_RATE)
+        for start in range(0, len(pcm) - _VAD_FRAME_BYTES + 1, _VAD_FRAME_BYTES)
+    ]
+
+
+def _speech_segments(pcm: bytes, flags: list[bool]) -> list[tuple[int, int]]:
+    """Return padded (start, end) byte offsets of the speech in a PCM buffer."""
+    min_silence = VAD_MIN_SILENCE_MS * _PCM_BYTES_PER_MS
+    padding = VAD_PADDING_MS * _PCM_BYTES_PER_MS
+    
+    segments = []
+    for index, is_speech in enumerate(flags):
+        if not is_speech:
+            continue
+        start = index * _VAD_FRAME_BYTES
+        end = start + _VAD_FRAME_BYTES
+        if segments and start - segments[-1][1] < min_silence:
+            segments[-1][1] = end
+        else:
+            segments.append([start, end])
+    return [(max(0, start - padding), min(len(pcm), end + padding)) for start, end in segments]
+
+
+def _pause_cut(flags: list[bool], start: int, max_bytes: int) -> int:
+    """
+    Pick where to cut speech that starts at `start` and runs past max_bytes.
+    
+    Returns the byte offset at the middle of the longest non-speech run in
+    the second half of the allowed span, so words are not split. Only if
+    there is no pause at all is the speech cut exactly at the limit.
+    """
+    first = -(-(start + max_bytes // 2) // _VAD_FRAME_BYTES)  # first whole frame
+    last = (start + max_bytes) // _VAD_FRAME_BYTES
+    best_length, cut = 0, start + max_bytes
+    run_start = None
+    for index in range(first, last + 1):
+        if index < last and index < len(flags) and not flags[index]:
+            if run_start is None:
+                run_start = index
+        elif run_start is not None:
+            if index - run_start > best_length:
+                best_length = index - run_start
+                cut = (run_start + index) * _VAD_FRAME_BYTES // 2
+            run_start = None
+    return cut
+
+
+def _group_speech(pcm: bytes, segments: list[tuple[int, int]], flags: list[bool]) -> list[bytes]:
+    """Concatenate speech segments into chunks of at most STT_CHUNK_SECONDS."""
+    max_bytes = STT_CHUNK_SECONDS * 1000 * _PCM_BYTES_PER_MS
+    chunks = []
+    current = bytearray()
+    for start, end in segments:
+        if current and len(current) + (end - start) > max_bytes:
+            chunks.append(bytes(current))
+            current.clear()
+        # Continuous speech longer than the limit is split at its pauses
+        while end - start > max_bytes:
+            cut = _pause_cut(flags, start, max_bytes)
+            chunks.append(pcm[start:cut])
+            start = cut
+        current += pcm[start:end]
+    if current:
+        chunks.append(bytes(current))
+    return chunks
+
+
+def _wav_file(pcm: bytes) -> io.BytesIO:
+    """Wrap 16kHz mono PCM in an in-memory WAV file."""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(VAD_SAMPLE_RATE)
+        wav.writeframes(pcm)
+    buf.seek(0)
+    return buf
+
+
+def extract_speech_chunks(audio_file) -> list[bytes] | None:
+    """
+    Trim non-speech from an uploaded recording.
+    
+    Returns a list of 16kHz mono PCM chunks containing only speech (empty if
+    no speech was detected), or None if VAD is unavailable or the audio could
+    not be decoded - in which case the original upload should be used.
+    This is CPU-bound; call it from a worker thread.
+    """
+    if av is None or webrtcvad is None:
+        return None
+    try:
+        pcm = _decode_to_pcm(audio_file)
+    except Exception as e:
+        # Metadata only: the error type, never the audio
+        logger.warning("event=%s error=%s", "vad_decode_failed", type(e).__name__)
+        return None
+    finally:
+        audio_file.seek(0)
+    flags = _speech_flags(pcm)
+    return _group_speech(pcm, _speech_segments(pcm, flags), flags)
+
+
+async def transcribe_speech_chunks(client, speech_chunks: list[bytes]) -> str:
+    """
+    Transcribe PCM speech chunks concurrently and join the text in order.
+    
+    If one request fails, the TaskGroup cancels the others instead of
+    leaving them running, and the underlying error is re-raised.
+    """
+    semaphore = asyncio.Semaphore(STT_MAX_CONCURRENCY)
+    
+    async def transcribe_chunk(pcm: bytes) -> str:
+        async with semaphore:
+            return await client.audio.transcriptions.create(
+                model="whisper-1",
+                file=("speech.wav", _wav_file(pcm), "audio/wav"),
+                response_format="text"
+            )
+    
+    try:
+        async with asyncio.TaskGroup() as group:
+            tasks = [group.create_task(transcribe_chunk(pcm)) for pcm in speech_chunks]
+    except ExceptionGroup as errors:
+        # Report the underlying error, not the group wrapper
+        raise errors.exceptions[0]
+    texts = (task.result().strip() for task in tasks)
+    return " ".join(text for text in texts if text)
+
+
 @app.post("/api/stt")
 async def speech_to_text(audio: UploadFile = File(...)):
     """
@@ -145,20 +619,23 @@ async def speech_to_text(audio: UploadFile = File(...)):
     try:
         client = get_openai_client()
         
-        # Read audio file content
-        audio_content = await audio.read()
-        
-        # Create a file-like object for OpenAI API
-        import io
-        audio_file = io.BytesIO(audio_content)
-        audio_file.name = audio.filename or "audio.webm"
+        # Trim silence off the main event loop
+        audio.file.seek(0)
+        speech_chunks = await asyncio.to_thread(extract_speech_chunks, audio.file)
         
-        # Transcribe using Whisper
-        transcription = await client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file,
-            response_format="text"
-        )
+        if speech_chunks is None:
+            # No VAD available: pass the upload's spooled temp file straight
+            # through instead of copying it into memory
+            audio_file = (audio.filename or "audio.webm", audio.file, audio.content_type)
+            
+            # Transcribe using Whisper
+            transcription = await client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file,
+                response_format="text"
+            )
+        else:
+            transcription = await transcribe_speech_chunks(client, speech_chunks)
         
         # Note: We intentionally do NOT log the transcribed content
         return {"text": transcription}
@@ -182,32 +659,29 @@ async def text_to_speech(request: TTSRequest):
     Uses OpenAI's TTS API to convert the assistant's response to audio.
     The text is NOT stored or logged - only used for real-time audio generation.
     
-    Returns: Audio bytes (MP3 format) with appropriate Content-Type header.
+    Returns: Raw PCM audio (24kHz, 16-bit little-endian, mono) with the
+             sample rate in the Content-Type header. The audio is streamed
+             as OpenAI generates it, so playback can start before synthesis
+             has finished.
     """
+    # The streaming response must stay open until the last chunk is sent,
+    # so its context is handed over to the HTTP response on success.
+    stack = AsyncExitStack()
     try:
         client = get_openai_client()
         
         # Generate speech using OpenAI TTS
-        # Using 'alloy' voice - options: alloy, echo, fable, onyx, nova, shimmer
-        response = await client.audio.speech.create(
-            model="tts-1",
-            voice="nova",  # Nova has a warm, conversational tone suitable for therapy
-            input=request.text,
-            response_format="mp3"
-        )
-        
-        # Get audio bytes
-        audio_bytes = response.content
-        
-        # Return audio with proper content type
-        # Note: We intentionally do NOT log the text content
-        return Response(
-            content=audio_bytes,
-            media_type="audio/mpeg",
-            headers={"Content-Disposition": "inline; filename=response.mp3"}
+        response = await stack.enter_async_context(
+            client.audio.speech.with_streaming_response.create(
+                model=TTS_MODEL,
+                voice=TTS_VOICE,
+                input=request.text,
+                response_format=TTS_RESPONSE_FORMAT
+            )
         )
         
     except Exception as e:
+        await stack.aclose()
         error_message = str(e)
         if "api_key" in error_message.lower():
             error_message = "OpenAI API key not configured"
@@ -216,6 +690,103 @@ async def text_to_speech(request: TTSRequest):
             status_code=500,
             media_type="application/json"
         )
+    
+    # Return audio with proper content type
+    # Note: We intentionally do NOT log the text content
+    return ClosingStreamingResponse(
+        response.iter_bytes(8192),
+        exit_stack=stack,
+        media_type=TTS_MEDIA_TYPE,
+        headers={"Content-Disposition": "inline; filename=response.pcm"}
+    )
+
+
+async def receive_messages(websocket: WebSocket, inbox: asyncio.Queue):
+    """
+    Read incoming WebSocket text frames into a queue.
+    
+    Runs for the lifetime of the connection so a disconnect is noticed even
+    while a reply is streaming. A None sentinel is queued when reading stops;
+    the exception that stopped it (usually WebSocketDisconnect) is re-raised.
+    """
+    try:
+        while True:
+            await inbox.put(await websocket.receive_text())
+    finally:
+        inbox.put_nowait(None)
+
+
+async def stream_reply(websocket: WebSocket, session_id: str, model_name: str, messages: list):
+    """
+    Stream one chat completion to the client and record its billing metadata.
+    
+    If the task is cancelled (client disconnected), leaving the stream's
+    context closes the upstream response so OpenAI stops generating tokens.
+    The partial duration is still billed.
+    """
+    # Start timing for billing
+    start_ns = time.monotonic_ns()
+    end_time = None
+    
+    async with FrameBatcher(websocket) as batcher:
+        try:
+            client = get_openai_client()
+            stream = await client.chat.completions.create(
+                model=model_name,
+                messages=messages,
+                stream=True,
+            )
+            
+            # Stream response chunks to client, coalesced into batches
+            # ❌ We do NOT accumulate or log the full response
+            # Hot path: bind everything per-token to locals up front
+            add = batcher.add
+            dumps = orjson.dumps
+            prefix = _CHUNK_PREFIX
+            suffix = _FRAME_SUFFIX
+            async with stream:
+                async for chunk in stream:
+                    choices = chunk.choices
+                    if not choices:
+                        continue
+                    content = choices[0].delta.content
+                    if content:
+                        await add(prefix + dumps(content) + suffix)
+            
+            # Calculate duration for billing
+            duration_ns = time.monotonic_ns() - start_ns
+            end_time = time.time()
+            
+            # Send the done frame first; billing and logging run in
+            # the background so they never delay it
+            try:
+                await batcher.add(_DONE_FRAME)
+                await batcher.flush()
+            finally:
+                # Record billing metadata ONLY (no clinical content)
+                run_in_background(
+                    record_turn(session_id, duration_ns, model_name, end_time)
+                )
+            
+        except asyncio.CancelledError:
+            # Bill the partial turn, unless it finished and was already billed
+            if end_time is None:
+                run_in_background(record_turn(
+                    session_id, time.monotonic_ns() - start_ns, model_name, time.time(),
+                    event="cancelled"
+                ))
+            raise
+            
+        except Exception as e:
+            error_message = str(e)
+            if "api_key" in error_message.lower():
+                error_message = "OpenAI API key not configured. Please set OPENAI_API_KEY in Replit Secrets."
+            await batcher.add(encode_error_frame(error_message))
+            # Metadata logging only - no clinical content in error
+            logger.warning("session=%s event=%s", session_id, "error")
+        
+        # Always flush so the done/error frame is never held back
+        await batcher.flush()
 
 
 @app.websocket("/ws/chat")
@@ -231,6 +802,10 @@ async def websocket_chat(websocket: WebSocket):
     Billing:
     - Each interaction generates a billing record with duration
     - No clinical content is included in billing records
+    
+    Disconnects:
+    - A reply in progress is cancelled as soon as the client disconnects,
+      so tokens nobody will read are not generated (or paid for)
     """
     await websocket.accept()
     
@@ -239,78 +814,75 @@ async def websocket_chat(websocket: WebSocket):
     model_name = "gpt-4o-mini"
     
     # Metadata logging only - no clinical content
-    print(f"Session {session_id}: WebSocket connection opened")
+    logger.info("session=%s event=%s", session_id, "connected")
+    
+    inbox = asyncio.Queue()
+    reader = asyncio.create_task(receive_messages(websocket, inbox))
     
     try:
         while True:
-            data = await websocket.receive_text()
-            message = json.loads(data)
+            data = await inbox.get()
+            if data is None:
+                # Reading stopped; re-raise whatever stopped it
+                await reader
+                break
             
-            if message.get("type") == "user_message":
-                # Extract patient text - DO NOT LOG THIS
+            # Extract patient text - DO NOT LOG THIS
+            # Fast path: a "u"-prefixed text frame is a user message, so no
+            # JSON parsing is needed. JSON frames are still accepted.
+            if data[:1] == "u":
+                patient_text = data[1:]
+            else:
+                message = orjson.loads(data)
+                if message.get("type") != "user_message":
+                    continue
                 patient_text = message.get("text", "")
-                # ❌ print(patient_text)  # NEVER log clinical content
-                
-                # Start timing for billing
-                start_time = time.time()
-                
-                # Build messages with master prompt injection
-                # therapist_whisper is None for now - can be added later
-                messages = build_messages(patient_text, therapist_whisper=None)
-                
+            # ❌ logger.info(patient_text)  # NEVER log clinical content
+            
+            # Build messages with master prompt injection
+            # therapist_whisper is None for now - can be added later
+            messages = build_messages(patient_text, therapist_whisper=None)
+            
+            # Race the reply against the reader, which finishes on disconnect
+            reply = asyncio.create_task(stream_reply(websocket, session_id, model_name, messages))
+            await asyncio.wait({reply, reader}, return_when=asyncio.FIRST_COMPLETED)
+            if not reply.done():
+                reply.cancel()
                 try:
-                    client = get_openai_client()
-                    stream = await client.chat.completions.create(
-                        model=model_name,
-                        messages=messages,
-                        stream=True,
-                    )
-                    
-                    # Stream response chunks to client
-                    # ❌ We do NOT accumulate or log the full response
-                    async for chunk in stream:
-                        if chunk.choices and len(chunk.choices) > 0:
-                            delta = chunk.choices[0].delta
-                            if delta.content:
-                                await websocket.send_text(json.dumps({
-                                    "type": "chunk",
-                                    "text": delta.content
-                                }))
-                    
-                    # Calculate duration for billing
-                    end_time = time.time()
-                    duration_seconds = end_time - start_time
-                    
-                    # Record billing metadata ONLY (no clinical content)
-                    BILLING_RECORDS.append({
-                        "session_id": session_id,
-                        "duration_seconds": round(duration_seconds, 2),
-                        "model": model_name,
-                        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
-                    })
-                    
-                    # Metadata logging only
-                    print(f"Session {session_id}: chat completed, duration_seconds={duration_seconds:.2f}")
-                    
-                    await websocket.send_text(json.dumps({"type": "done"}))
-                    
-                except Exception as e:
-                    error_message = str(e)
-                    if "api_key" in error_message.lower():
-                        error_message = "OpenAI API key not configured. Please set OPENAI_API_KEY in Replit Secrets."
-                    await websocket.send_text(json.dumps({
-                        "type": "error",
-                        "text": error_message
-                    }))
-                    # Metadata logging only - no clinical content in error
-                    print(f"Session {session_id}: request encountered an error")
-                    
+                    await reply
+                except asyncio.CancelledError:
+                    pass
+                continue
+            reply.result()
+                
     except WebSocketDisconnect:
-        print(f"Session {session_id}: WebSocket connection closed")
+        logger.info("session=%s event=%s", session_id, "disconnected")
     except Exception as e:
-        print(f"Session {session_id}: WebSocket error occurred")
+        logger.warning("session=%s event=%s", session_id, "ws_error")
+    finally:
+        reader.cancel()
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=5000, reload=True)
+    # uvloop + httptools cut event-loop and parsing overhead per request and
+    # WebSocket frame. Auto-reload is off: it is a development-only feature.
+    #
+    # Multiple worker processes share one listening socket and the kernel
+    # spreads new connections across them. Billing records are only shared
+    # between workers through Redis, so without REDIS_URL a single worker is
+    # used by default. WEB_CONCURRENCY overrides the worker count.
+    default_workers = (os.cpu_count() or 1) if REDIS_URL else 1
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=5000,
+        workers=int(os.environ.get("WEB_CONCURRENCY", default_workers)),
+        loop="uvloop",
+        http="httptools",
+        ws="websockets",
+        # Token frames are a few bytes each; per-message deflate would only
+        # add zlib work per send and can even grow the payload
+        ws_per_message_deflate=False,
+        reload=False,
+    )
@@ -0,0 +1,407 @@
+"""Tests for the therapy chat backend, run against a fake OpenAI client."""
+
+import array
+import asyncio
+import functools
+import io
+import math
+import time
+import types
+import wave
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.requests import ClientDisconnect
+
+import main
+
+
+# =============================================================================
+# HELPERS
+# =============================================================================
+
+RATE = 16000
+
+
+def _voiced(seconds: float) -> array.array:
+    """A crude voiced signal (harmonic series with a wobbling pitch)."""
+    samples = array.array("h")
+    phase = 0.0
+    for n in range(int(seconds * RATE)):
+        t = n / RATE
+        phase += 2 * math.pi * (140 + 20 * math.sin(2 * math.pi * 3 * t)) / RATE
+        value = sum(math.sin(k * phase) / k for k in range(1, 8))
+        envelope = 0.5 + 0.5 * abs(math.sin(2 * math.pi * 2.5 * t))
+        samples.append(int(max(-1.0, min(1.0, value * envelope * 0.3)) * 32767))
+    return samples
+
+
+@functools.lru_cache
+def make_webm(*parts: tuple[str, float]) -> bytes:
+    """Encode ("speech" | "silence", seconds) parts as a WebM/Opus recording."""
+    av = pytest.importorskip("av")
+    pytest.importorskip("webrtcvad")
+    
+    pcm = array.array("h")
+    for kind, seconds in parts:
+        if kind == "speech":
+            pcm.extend(_voiced(seconds))
+        else:
+            pcm.extend(array.array("h", bytes(int(seconds * RATE) * 2)))
+    
+    buf = io.BytesIO()
+    with av.open(buf, mode="w", format="webm") as container:
+        stream = container.add_stream("libopus", rate=RATE)
+        stream.layout = "mono"
+        frame_samples = 320
+        for start in range(0, len(pcm), frame_samples):
+            chunk = pcm[start:start + frame_samples]
+            chunk.extend([0] * (frame_samples - len(chunk)))
+            frame = av.AudioFrame(format="s16", layout="mono", samples=frame_samples)
+            frame.sample_rate = RATE
+            frame.planes[0].update(chunk.tobytes())
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return buf.getvalue()
+
+
+def wav_seconds(data: bytes) -> float:
+    with wave.open(io.BytesIO(data)) as wav:
+        return wav.getnframes() / wav.getframerate()
+
+
+class FakeTranscriptions:
+    """Records uploads and answers with the duration of each WAV chunk."""
+
+    def __init__(self):
+        self.uploads = []
+
+    async def create(self, model, file, response_format, **kwargs):
+        filename, fileobj, content_type = file
+        data = fileobj.read()
+        self.uploads.append((filename, data, content_type))
+        if content_type == "audio/wav":
+            return f"{wav_seconds(data):.1f}s\n"
+        return "raw upload\n"
+
+
+@pytest.fixture
+def openai_client(monkeypatch):
+    client = types.SimpleNamespace(
+        audio=types.SimpleNamespace(transcriptions=FakeTranscriptions()),
+    )
+    monkeypatch.setattr(main, "_openai_client", client)
+    return client
+
+
+def post_audio(data: bytes):
+    return TestClient(main.app).post(
+        "/api/stt",
+        files={"audio": ("recording.webm", data, "audio/webm")},
+    )
+
+
+# =============================================================================
+# SPEECH-TO-TEXT
+# =============================================================================
+
+def test_stt_trims_silence_before_whisper(openai_client):
+    recording = make_webm(("silence", 2), ("speech", 3), ("silence", 3),
+                          ("speech", 2), ("silence", 2))
+
+    response = post_audio(recording)
+
+    assert response.status_code == 200
+    uploads = openai_client.audio.transcriptions.uploads
+    assert len(uploads) == 1
+    filename, data, content_type = uploads[0]
+    assert (filename, content_type) == ("speech.wav", "audio/wav")
+    # 5s of speech plus padding, not the 12s recording
+    assert 5 <= wav_seconds(data) < 7
+    assert response.json() == {"text": f"{wav_seconds(data):.1f}s"}
+
+
+def test_stt_skips_whisper_for_silence(openai_client):
+    response = post_audio(make_webm(("silence", 3)))
+
+    assert response.json() == {"text": ""}
+    assert openai_client.audio.transcriptions.uploads == []
+
+
+def test_stt_splits_long_speech_at_a_pause(openai_client):
+    # ~40s of talking with short breaths: VAD keeps it as one segment, which
+    # must be split at a pause rather than mid-word at exactly 25s
+    recording = make_webm(*(("speech", 2.75), ("silence", 0.3)) * 13)
+    response = post_audio(recording)
+
+    uploads = openai_client.audio.transcriptions.uploads
+    assert len(uploads) == 2
+    durations = [wav_seconds(data) for _, data, _ in uploads]
+    assert response.json() == {"text": " ".join(f"{d:.1f}s" for d in durations)}
+    assert 12.5 < durations[0] < 25
+    # The cut lands inside a pause: the first chunk ends in silence
+    tail = array.array("h", uploads[0][1][-320:])
+    assert max(abs(sample) for sample in tail) < 1000
+
+
+def test_stt_cancels_remaining_chunks_on_failure(openai_client):
+    cancelled = []
+
+    async def create(model, file, response_format, **kwargs):
+        if file[1].getvalue().endswith(b"\x01\x00"):
+            raise RuntimeError("upstream failure")
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    openai_client.audio.transcriptions.create = create
+    chunks = [bytes(320), bytes(318) + b"\x01\x00", bytes(320)]
+
+    async def run():
+        with pytest.raises(RuntimeError, match="upstream failure"):
+            await main.transcribe_speech_chunks(openai_client, chunks)
+        # Checked before the event loop shuts down and cancels stragglers
+        return list(cancelled)
+
+    assert asyncio.run(run()) == [True, True]
+
+
+# =============================================================================
+# TEXT-TO-SPEECH
+# =============================================================================
+
+class FakeSpeechStream:
+    def __init__(self):
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+    async def iter_bytes(self, chunk_size):
+        for chunk in (b"\x00\x01", b"\x02\x03"):
+            yield chunk
+
+
+@pytest.fixture
+def speech_stream(monkeypatch):
+    stream = FakeSpeechStream()
+    client = types.SimpleNamespace(audio=types.SimpleNamespace(speech=types.SimpleNamespace(
+        with_streaming_response=types.SimpleNamespace(create=lambda **kwargs: stream),
+    )))
+    monkeypatch.setattr(main, "_openai_client", client)
+    return stream
+
+
+def test_tts_streams_audio_and_closes_upstream(speech_stream):
+    response = TestClient(main.app).post("/api/tts", json={"text": "hello"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == main.TTS_MEDIA_TYPE
+    assert response.content == b"\x00\x01\x02\x03"
+    assert speech_stream.closed
+
+
+def test_tts_closes_upstream_when_client_is_gone(speech_stream):
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        raise OSError("client went away")
+
+    async def run():
+        response = await main.text_to_speech(main.TTSRequest(text="hello"))
+        scope = {"type": "http", "asgi": {"spec_version": "2.4"}}
+        with pytest.raises((OSError, ClientDisconnect)):
+            await response(scope, receive, send)
+
+    asyncio.run(run())
+    assert speech_stream.closed
+
+
+# =============================================================================
+# OPENAI HTTP CLIENT
+# =============================================================================
+
+def test_openai_client_requires_key_before_opening_pool(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setattr(main.httpx, "AsyncClient", None)  # must not be reached
+
+    with pytest.raises(main.OpenAIError, match="api_key"):
+        main._create_openai_client()
+
+
+def test_startup_warm_up_does_not_retry(monkeypatch):
+    calls = []
+
+    async def list_models():
+        calls.append("list")
+
+    async def close():
+        calls.append("close")
+
+    def with_options(**options):
+        calls.append(options)
+        return types.SimpleNamespace(models=types.SimpleNamespace(list=list_models))
+
+    client = types.SimpleNamespace(with_options=with_options, close=close)
+    monkeypatch.setattr(main, "_openai_client", client)
+
+    with TestClient(main.app):
+        pass
+
+    assert calls == [{"max_retries": 0, "timeout": 5.0}, "list", "close"]
+    assert main._openai_client is None
+
+
+# =============================================================================
+# FRAME BATCHING
+# =============================================================================
+
+class FakeWebSocket:
+    def __init__(self, error=None):
+        self.sent = []
+        self.error = error
+
+    async def send_bytes(self, data):
+        if self.error:
+            raise self.error
+        self.sent.append(data)
+
+
+def test_frame_batcher_coalesces_frames_in_order():
+    ws = FakeWebSocket()
+
+    async def run():
+        async with main.FrameBatcher(ws) as batcher:
+            await batcher.add(b"a\n")
+            await batcher.add(b"b\n")
+            assert ws.sent == []
+            await batcher.flush()
+            # Reaching FLUSH_MAX_BYTES sends immediately, with the earlier frame first
+            await batcher.add(b"c\n")
+            await batcher.add(b"d" * main.FLUSH_MAX_BYTES)
+            assert ws.sent == [b"a\nb\n", b"c\n" + b"d" * main.FLUSH_MAX_BYTES]
+            # A partially filled buffer is sent by the timer
+            await batcher.add(b"e\n")
+            await asyncio.sleep(main.FLUSH_INTERVAL_SECONDS * 3)
+            assert ws.sent[2:] == [b"e\n"]
+
+    asyncio.run(run())
+
+
+def test_frame_batcher_timer_send_failure_does_not_mask_cancellation():
+    ws = FakeWebSocket(error=OSError("client went away"))
+
+    async def reply():
+        async with main.FrameBatcher(ws) as batcher:
+            await batcher.add(b"a\n")
+            await asyncio.sleep(10)
+
+    async def run():
+        task = asyncio.create_task(reply())
+        await asyncio.sleep(main.FLUSH_INTERVAL_SECONDS * 3)  # timer send fails
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(run())
+
+
+# =============================================================================
+# CHAT WEBSOCKET
+# =============================================================================
+
+def text_chunk(text: str):
+    delta = types.SimpleNamespace(content=text)
+    return types.SimpleNamespace(choices=[types.SimpleNamespace(delta=delta)])
+
+
+class FakeChatStream:
+    """Yields one token, then (if stall) hangs like a slow upstream until closed."""
+
+    def __init__(self):
+        self.closed = False
+        self.stall = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.closed = True
+
+    async def __aiter__(self):
+        yield text_chunk("Hi")
+        if self.stall:
+            await asyncio.Event().wait()
+
+
+@pytest.fixture
+def chat_stream(monkeypatch):
+    stream = FakeChatStream()
+
+    async def create(**kwargs):
+        return stream
+
+    async def list_models():
+        pass
+
+    async def close():
+        pass
+
+    client = types.SimpleNamespace(
+        chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)),
+        with_options=lambda **options: types.SimpleNamespace(
+            models=types.SimpleNamespace(list=list_models)),
+        close=close,
+    )
+    monkeypatch.setattr(main, "_openai_client", client)
+    monkeypatch.setattr(main, "BILLING_RECORDS", main.deque(maxlen=10))
+    return stream
+
+
+def wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_chat_disconnect_mid_stream_closes_upstream_and_bills_once(chat_stream):
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws/chat") as ws:
+            ws.send_text("uhello")
+            assert ws.receive_bytes() == b'{"type":"chunk","text":"Hi"}\n'
+        # Leaving the block disconnects while the reply is still streaming
+
+        assert wait_for(lambda: chat_stream.closed)
+        assert wait_for(lambda: main.BILLING_RECORDS)
+        time.sleep(0.05)
+        assert len(main.BILLING_RECORDS) == 1
+
+
+def test_chat_sends_done_before_billing_and_flushes_billing_on_shutdown(chat_stream, monkeypatch):
+    chat_stream.stall = False
+    record_billing = main.record_billing
+
+    async def slow_record_billing(record):
+        await asyncio.sleep(0.2)
+        await record_billing(record)
+
+    monkeypatch.setattr(main, "record_billing", slow_record_billing)
+
+    with TestClient(main.app) as client:
+        with client.websocket_connect("/ws/chat") as ws:
+            ws.send_text("uhello")
+            while b'"done"' not in (data := ws.receive_bytes()):
+                pass
+            assert data.endswith(main._DONE_FRAME)
+            assert len(main.BILLING_RECORDS) == 0
+    # Shutdown waits for the pending billing write
+    assert len(main.BILLING_RECORDS) == 1